@@ -1,3 +1,34 @@
+import argparse
+import contextlib
+import cProfile
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+PARALLEL_INGEST_THRESHOLD = 10000
+
+PROFILE_TOP_N = 20
+
+EXPORT_FIELDS = {
+    "books": ("id", "title", "author", "available"),
+    "users": ("username", "is_admin", "books_borrowed"),
+    "loans": ("book_id", "title", "username"),
+}
+
+
 class UserNotFoundError(Exception):
     """
     Exception raised when a user is not found in the library.
@@ -14,6 +45,536 @@ class BookNotFoundError(Exception):
     pass
 
 
+class ReadOnlyLibraryError(Exception):
+    """
+    Exception raised when a mutation is attempted on a read-only library,
+    such as a replica or a snapshot, or directly on a book or user owned by a library.
+    """
+
+    pass
+
+
+class Change:
+    """
+    A class to represent a single mutation published by a library.
+
+    Attributes:
+        seq (int): Position of the change in the library's change stream, starting at 1.
+        action (str): The name of the mutation, e.g. "add_book" or "borrow".
+        args (tuple): The arguments needed to replay the mutation.
+        timestamp (float): The time the change was published.
+    """
+
+    def __init__(self, seq, action, args):
+        """
+        Initializes a new Change instance.
+
+        Args:
+            seq (int): Position of the change in the change stream.
+            action (str): The name of the mutation.
+            args (tuple): The arguments needed to replay the mutation.
+        """
+        self.seq = seq
+        self.action = action
+        self.args = args
+        self.timestamp = time.time()
+
+    def to_dict(self):
+        """
+        Converts the change to a dictionary of JSON-compatible values.
+
+        Returns:
+            dict: The sequence number, action, arguments and timestamp of the change.
+        """
+        return {
+            "seq": self.seq,
+            "action": self.action,
+            "args": list(self.args),
+            "timestamp": self.timestamp,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a change from a dictionary produced by to_dict.
+
+        Args:
+            data (dict): The dictionary representation of the change.
+
+        Returns:
+            Change: The restored change.
+        """
+        change = cls(data["seq"], data["action"], tuple(data["args"]))
+        change.timestamp = data["timestamp"]
+        return change
+
+    def to_json(self):
+        """
+        Serializes the change to a single JSON line, e.g. to send it to another process.
+
+        Returns:
+            str: The JSON representation of the change, without a trailing newline.
+        """
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, line):
+        """
+        Deserializes a change from a JSON line produced by to_json.
+
+        Args:
+            line (str): The JSON representation of the change.
+
+        Returns:
+            Change: The restored change.
+        """
+        return cls.from_dict(json.loads(line))
+
+
+_DELETED = object()
+
+
+class Generations:
+    """
+    A class to track the write generation of a library and the generations
+    still seen by its live snapshots.
+
+    Attributes:
+        current (int): The generation new writes belong to.
+    """
+
+    def __init__(self):
+        """
+        Initializes a new Generations instance.
+        """
+        self.current = 0
+        self._live = Counter()
+
+    def start_snapshot(self, snapshot):
+        """
+        Registers a snapshot of the current state and starts a new generation.
+
+        Args:
+            snapshot (object): The snapshot, released when it is garbage collected.
+
+        Returns:
+            int: The generation seen by the snapshot.
+        """
+        generation = self.current
+        self.current += 1
+        self._live[generation] += 1
+        weakref.finalize(snapshot, self._release, generation)
+        return generation
+
+    def _release(self, generation):
+        """
+        Unregisters a garbage collected snapshot.
+
+        Args:
+            generation (int): The generation seen by the snapshot.
+        """
+        self._live[generation] -= 1
+        if not self._live[generation]:
+            del self._live[generation]
+
+    def has_live(self):
+        """
+        Checks if any snapshot is still alive.
+
+        Returns:
+            bool: True if there is a live snapshot, False otherwise.
+        """
+        return bool(self._live)
+
+    def oldest(self):
+        """
+        Retrieves the oldest generation seen by a live snapshot.
+
+        Returns:
+            int: The oldest generation, or None if there are no live snapshots.
+        """
+        return min(self._live, default=None)
+
+
+class VersionedMap:
+    """
+    A class to represent a mapping which keeps the old values seen by live snapshots.
+
+    The current values are kept in a plain dictionary, which the library reads
+    directly. While a snapshot is alive, the first write to a key in each
+    generation saves the previous value to the key's history, so snapshot setup
+    and writes both take O(1). The history is dropped once no snapshot needs it.
+
+    Keys are also kept in an append-only list, so that a snapshot can be iterated
+    while the map is written. Deleted keys keep their position and are removed
+    from the list once they are the majority and no snapshot is alive.
+    """
+
+    def __init__(self, generations):
+        """
+        Initializes a new, empty VersionedMap instance.
+
+        Args:
+            generations (Generations): The generations of the owning library.
+        """
+        self._generations = generations
+        self.current = {}
+        self._history = {}
+        self._order = []
+        self._positions = {}
+
+    def __len__(self):
+        """
+        Retrieves the number of keys in the current version of the map.
+
+        Returns:
+            int: The number of keys.
+        """
+        return len(self.current)
+
+    def view(self, generation=None):
+        """
+        Creates a read-only view of the map as seen by a generation.
+
+        Args:
+            generation (int, optional): The generation of a live snapshot, the latest one if not provided.
+
+        Returns:
+            VersionedMapView: The view of the map.
+        """
+        if generation is None:
+            return VersionedMapView(self)
+        return VersionedMapView(self, generation, len(self.current), len(self._order))
+
+    def get(self, key, generation=None):
+        """
+        Retrieves the value of a key as seen by a generation.
+
+        Args:
+            key: The key to look up.
+            generation (int, optional): The generation, the latest one if not provided.
+
+        Returns:
+            The value, or None if the key is not present in the generation.
+        """
+        if generation is not None:
+            for saved_generation, value in self._history.get(key, ()):
+                if saved_generation > generation:
+                    return None if value is _DELETED else value
+        return self.current.get(key)
+
+    def key_at(self, index, generation=None, order_length=None):
+        """
+        Retrieves the key at a position in insertion order, as seen by a generation.
+
+        This takes O(1) for the current version while no keys were deleted,
+        and O(n) otherwise.
+
+        Args:
+            index (int): The non-negative position of the key.
+            generation (int, optional): The generation, the latest one if not provided.
+            order_length (int, optional): The length of the key list when the snapshot was taken.
+
+        Returns:
+            The key at the position.
+
+        Raises:
+            IndexError: If there are not enough keys.
+        """
+        if generation is None and len(self._order) == len(self.current):
+            return self._order[index]
+        for position, key in enumerate(self.keys(generation, order_length)):
+            if position == index:
+                return key
+        raise IndexError(index)
+
+    def keys(self, generation=None, order_length=None):
+        """
+        Iterates over the keys present in a generation.
+
+        The current keys are iterated directly from the dictionary. The keys of
+        a snapshot are iterated lazily, in insertion order, and can be iterated
+        while the map is written.
+
+        Args:
+            generation (int, optional): The generation, the latest one if not provided.
+            order_length (int, optional): The length of the key list when the snapshot was taken.
+
+        Returns:
+            Iterator: The keys present in the generation.
+        """
+        if generation is None:
+            return iter(self.current)
+        return (
+            self._order[position]
+            for position in range(order_length)
+            if self.get(self._order[position], generation) is not None
+        )
+
+    def set(self, key, value):
+        """
+        Sets the value of a key in the current generation.
+
+        Args:
+            key: The key to set.
+            value: The new value, which must not be None.
+        """
+        self._save(key)
+        if key not in self._positions:
+            self._positions[key] = len(self._order)
+            self._order.append(key)
+        self.current[key] = value
+
+    def delete(self, key):
+        """
+        Deletes a key in the current generation.
+
+        Args:
+            key: The key to delete.
+        """
+        self._save(key)
+        del self.current[key]
+        if (
+            not self._generations.has_live()
+            and len(self._order) > 2 * len(self.current) + 32
+        ):
+            self._order = list(self.current)
+            self._positions = {
+                key: position for position, key in enumerate(self._order)
+            }
+
+    def writable(self, key, copy):
+        """
+        Retrieves a value that can be mutated in place without affecting snapshots.
+
+        Args:
+            key: A key present in the current generation.
+            copy (callable): A function that copies a value.
+
+        Returns:
+            The current value, copied first if it may be seen by a live snapshot.
+        """
+        if not self._generations.has_live():
+            return self.current[key]
+        history = self._history.get(key)
+        if history is None or history[-1][0] != self._generations.current:
+            self.set(key, copy(self.current[key]))
+        return self.current[key]
+
+    def _save(self, key):
+        """
+        Saves the value of a key before its first write in the current generation,
+        if a live snapshot may need it.
+
+        Args:
+            key: The key about to be written.
+        """
+        if not self._generations.has_live():
+            if self._history:
+                self._history.clear()
+            return
+
+        current = self._generations.current
+        history = self._history.setdefault(key, [])
+        if history and history[-1][0] == current:
+            return
+        oldest = self._generations.oldest()
+        while history and history[0][0] <= oldest:
+            del history[0]
+        history.append((current, self.current.get(key, _DELETED)))
+
+
+class VersionedMapView(Mapping):
+    """
+    A class to represent a read-only mapping view of a VersionedMap as seen by a generation.
+    """
+
+    def __init__(self, versioned_map, generation=None, length=None, order_length=None):
+        """
+        Initializes a new VersionedMapView instance.
+
+        Args:
+            versioned_map (VersionedMap): The map to view.
+            generation (int, optional): The generation to view, the latest one if not provided.
+            length (int, optional): The number of keys in the generation, if not the latest.
+            order_length (int, optional): The length of the key list, if not the latest generation.
+        """
+        self._map = versioned_map
+        self._generation = generation
+        self._length = length
+        self._order_length = order_length
+
+    def __getitem__(self, key):
+        value = self._map.get(key, self._generation)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return self._map.keys(self._generation, self._order_length)
+
+    def __len__(self):
+        return len(self._map) if self._generation is None else self._length
+
+    def values(self):
+        if self._generation is None:
+            return self._map.current.values()
+        return (self._map.get(key, self._generation) for key in self)
+
+    def key_at(self, index):
+        """
+        Retrieves the key at a position in insertion order.
+
+        Args:
+            index (int): The non-negative position of the key.
+
+        Returns:
+            The key at the position.
+        """
+        return self._map.key_at(index, self._generation, self._order_length)
+
+
+class BookList(Sequence):
+    """
+    A class to represent a read-only list of books, backed by a mapping view of books by ID.
+    """
+
+    def __init__(self, books_by_id):
+        """
+        Initializes a new BookList instance.
+
+        Args:
+            books_by_id (VersionedMapView): The books, keyed by ID in insertion order.
+        """
+        self._books_by_id = books_by_id
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._books_by_id[self._books_by_id.key_at(index)]
+
+    def __iter__(self):
+        return iter(self._books_by_id.values())
+
+    def __len__(self):
+        return len(self._books_by_id)
+
+
+def normalize_author(author):
+    """
+    Normalizes an author's name for lookups, ignoring case and extra whitespace.
+
+    Args:
+        author (str): The author's name.
+
+    Returns:
+        str: The normalized author's name.
+    """
+    return " ".join(author.casefold().split())
+
+
+def catalog_key(entry):
+    """
+    Computes the duplicate detection key of a catalog entry.
+
+    The title and author are compared ignoring case and punctuation, and the
+    author also ignoring the order of names, e.g. "Bee, Anne" and "Anne Bee".
+
+    Args:
+        entry (tuple): The title and author of the entry.
+
+    Returns:
+        bytes: The hash of the normalized title and author.
+    """
+    title, author = entry
+    title_words = re.sub(r"\W+", " ", title.casefold()).split()
+    author_words = sorted(re.sub(r"\W+", " ", author.casefold()).split())
+    normalized = " ".join(title_words) + "\0" + " ".join(author_words)
+    return hashlib.blake2b(normalized.encode(), digest_size=16).digest()
+
+
+def find_duplicates(entries, existing=(), workers=None):
+    """
+    Splits catalog entries into unique entries and duplicates.
+
+    Keys are computed in a process pool when there are at least
+    PARALLEL_INGEST_THRESHOLD entries and more than one worker is available.
+
+    Args:
+        entries (list): A list of (title, author) tuples.
+        existing (iterable, optional): (title, author) tuples already in the library.
+        workers (int, optional): The number of worker processes, defaults to the CPU count.
+
+    Returns:
+        tuple: A list of unique entries and a list of (entry, original) tuples,
+            where original is the entry the duplicate matches.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if len(entries) >= PARALLEL_INGEST_THRESHOLD and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            keys = list(executor.map(catalog_key, entries, chunksize=1000))
+    else:
+        keys = [catalog_key(entry) for entry in entries]
+
+    index = {catalog_key(entry): entry for entry in existing}
+    unique = []
+    duplicates = []
+    for entry, key in zip(entries, keys):
+        if key in index:
+            duplicates.append((entry, index[key]))
+        else:
+            index[key] = entry
+            unique.append(entry)
+    return unique, duplicates
+
+
+def ingest_catalog(library, path, merge=True, workers=None):
+    """
+    Adds books from a CSV catalog feed with "title" and "author" columns,
+    skipping entries that duplicate each other or books already in the library.
+
+    Args:
+        library (Library): The library to add the books to.
+        path (str): The path to the CSV file.
+        merge (bool, optional): If False, no books are added and duplicates are only reported.
+        workers (int, optional): The number of worker processes for large feeds.
+
+    Returns:
+        list: A list of (entry, original) tuples for each duplicate entry.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If the file is not a valid CSV file, does not have "title"
+            and "author" columns, or has a row with an empty title or author.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        try:
+            if not {"title", "author"} <= set(reader.fieldnames or ()):
+                raise ValueError(f"Catalog {path} must have title and author columns")
+            entries = []
+            for row in reader:
+                if not row["title"] or not row["author"]:
+                    raise ValueError(
+                        f"Line {reader.line_num} of catalog {path} has no title or author"
+                    )
+                entries.append((row["title"], row["author"]))
+        except csv.Error as e:
+            raise ValueError(f"Line {reader.line_num} of catalog {path}: {e}")
+
+    existing = [(book.title, book.author) for book in library.books]
+    unique, duplicates = find_duplicates(entries, existing, workers)
+
+    if merge:
+        for title, author in unique:
+            library.add_book(title, author)
+    return duplicates
+
+
 class Book:
     """
     A class to represent a book in the library.
@@ -24,6 +585,7 @@ class Book:
         title (str): The title of the book.
         author (str): The author of the book.
         available (bool): The availability status of the book.
+        library (Library): The library owning the book, None for a standalone book.
     """
 
     last_id = 0
@@ -39,29 +601,53 @@ class Book:
         cls.last_id += 1
         return cls.last_id
 
-    def __init__(self, title, author):
+    def __init__(self, title, author, book_id=None):
         """
         Initializes a new Book instance.
 
         Args:
             title (str): The title of the book.
             author (str): The author of the book.
+            book_id (int, optional): The ID of the book, generated if not provided.
         """
-        self.id = Book.generate_id()
+        self.id = book_id if book_id is not None else Book.generate_id()
         self.title = title
         self.author = author
         self.available = True
+        self.library = None
+
+    def copy(self):
+        """
+        Creates a copy of the book with the same ID, owned by the same library.
+
+        Returns:
+            Book: The copied book.
+        """
+        book = Book(self.title, self.author, self.id)
+        book.available = self.available
+        book.library = self.library
+        return book
 
     def borrow(self):
         """
-        Marks the book as borrowed (unavailable).
+        Marks a standalone book as borrowed (unavailable).
+
+        Raises:
+            ReadOnlyLibraryError: If the book is owned by a library, use Library.borrow instead.
         """
+        if self.library is not None:
+            raise ReadOnlyLibraryError("Use Library.borrow to borrow a library book")
         self.available = False
 
     def unborrow(self):
         """
-        Marks the book as available.
+        Marks a standalone book as available.
+
+        Raises:
+            ReadOnlyLibraryError: If the book is owned by a library, use Library.unborrow instead.
         """
+        if self.library is not None:
+            raise ReadOnlyLibraryError("Use Library.unborrow to return a library book")
         self.available = True
 
 
@@ -73,6 +659,7 @@ class User:
         username (str): The username of the user.
         borrowed_books (list): A list of books borrowed by the user.
         is_admin (bool): Indicates if the user is an admin.
+        library (Library): The library owning the user, None for a standalone user.
     """
 
     def __init__(self, username, is_admin):
@@ -86,23 +673,47 @@ class User:
         self.username = username
         self.borrowed_books = []
         self.is_admin = is_admin
+        self.library = None
+
+    def copy(self):
+        """
+        Creates a copy of the user with its own list of borrowed books,
+        owned by the same library.
+
+        Returns:
+            User: The copied user.
+        """
+        user = User(self.username, self.is_admin)
+        user.borrowed_books = list(self.borrowed_books)
+        user.library = self.library
+        return user
 
     def borrow(self, book):
         """
-        Adds a book to the user's borrowed list.
+        Adds a book to the borrowed list of a standalone user.
 
         Args:
             book (Book): The book to borrow.
+
+        Raises:
+            ReadOnlyLibraryError: If the user is owned by a library, use Library.borrow instead.
         """
+        if self.library is not None:
+            raise ReadOnlyLibraryError("Use Library.borrow to borrow a library book")
         self.borrowed_books.append(book)
 
     def unborrow(self, book):
         """
-        Removes a book from the user's borrowed list.
+        Removes a book from the borrowed list of a standalone user.
 
         Args:
             book (Book): The book to return.
+
+        Raises:
+            ReadOnlyLibraryError: If the user is owned by a library, use Library.unborrow instead.
         """
+        if self.library is not None:
+            raise ReadOnlyLibraryError("Use Library.unborrow to return a library book")
         if book in self.borrowed_books:
             self.borrowed_books.remove(book)
 
@@ -118,8 +729,15 @@ class User:
 
     def change_admin(self):
         """
-        Toggles the admin status of the user.
+        Toggles the admin status of a standalone user.
+
+        Raises:
+            ReadOnlyLibraryError: If the user is owned by a library, use Library.change_admin instead.
         """
+        if self.library is not None:
+            raise ReadOnlyLibraryError(
+                "Use Library.change_admin to change the admin status of a library user"
+            )
         self.is_admin = not self.is_admin
 
 
@@ -128,16 +746,377 @@ class Library:
     A class to represent a library.
 
     Attributes:
-        users (dict): A dictionary of library users, keyed by username.
-        books (list): A list of books in the library.
+        read_only (bool): Indicates if mutations of the library are rejected.
+        users (Mapping): A read-only mapping of library users, keyed by username.
+        books (Sequence): A read-only list of books in the library.
+        changes (list): The change stream, the published mutations not yet
+            acknowledged by all subscribers.
+        profile_dir (str): The directory for profiling reports of the current
+            profiling session, None if profiling is disabled.
     """
 
+    read_only = False
+
     def __init__(self):
         """
         Initializes a new Library instance.
         """
-        self.users = {}
-        self.books = []
+        self.changes = []
+        self._truncated_seq = 0
+        self._subscribers = {}
+        self._next_subscriber_id = 1
+        self._generations = Generations()
+        self._users = VersionedMap(self._generations)
+        self._books = VersionedMap(self._generations)
+        self._author_index = VersionedMap(self._generations)
+        self._available_author_index = VersionedMap(self._generations)
+        self._generation = None
+        self.users = self._users.view()
+        self._books_by_id = self._books.view()
+        self.books = BookList(self._books_by_id)
+        self._available_count = 0
+        self._loan_count = 0
+        self._admin_count = 0
+        self.profile_dir = None
+        self._profile_count = 0
+
+    def enable_profiling(self, profile_dir):
+        """
+        Enables profiling of commands, writing a report per command to a new
+        session directory, named after the start time and process ID, so that
+        sessions never overwrite each other's reports.
+
+        Args:
+            profile_dir (str): The parent directory of the session directories,
+                created if it does not exist.
+
+        Returns:
+            str: The session directory the reports are written to.
+
+        Raises:
+            OSError: If the session directory cannot be created.
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+        self.profile_dir = tempfile.mkdtemp(prefix=prefix, dir=profile_dir)
+        self._profile_count = 0
+        return self.profile_dir
+
+    def disable_profiling(self):
+        """
+        Disables profiling of commands.
+        """
+        self.profile_dir = None
+
+    @contextmanager
+    def profiled(self, name):
+        """
+        Profiles CPU time and memory allocations of a command, if profiling is enabled.
+
+        The report lists the cumulative time of functions in this module and
+        the lines that allocated the most memory while the command was running,
+        leaving out the profiling code itself. If the report cannot be written,
+        a warning is printed and profiling is disabled.
+
+        Args:
+            name (str): The name of the command, used in the report's file name.
+        """
+        if self.profile_dir is None:
+            yield
+            return
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        memory_before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            memory_after = tracemalloc.take_snapshot()
+            if not was_tracing:
+                tracemalloc.stop()
+            filters = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, contextlib.__file__),
+            ]
+            for _, _, lineno in Library.profiled.__wrapped__.__code__.co_lines():
+                if lineno is not None:
+                    filters.append(tracemalloc.Filter(False, __file__, lineno))
+            memory_stats = memory_after.filter_traces(filters).compare_to(
+                memory_before.filter_traces(filters), "lineno"
+            )
+            try:
+                self._write_profile(name, profiler, memory_stats)
+            except OSError as e:
+                print(f"Profiling report not written, profiling disabled: {e}")
+                self.disable_profiling()
+
+    def _write_profile(self, name, profiler, memory_stats):
+        """
+        Writes a profiling report of a command to the profiling directory.
+
+        Args:
+            name (str): The name of the command.
+            profiler (cProfile.Profile): The profiler that ran during the command.
+            memory_stats (list): Memory allocation differences, largest first.
+        """
+        self._profile_count += 1
+        safe_name = re.sub(r"\W+", "_", name) or "command"
+        path = os.path.join(
+            self.profile_dir, f"{self._profile_count:04d}-{safe_name}.txt"
+        )
+
+        cpu_report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=cpu_report)
+        for function in list(stats.stats):
+            if function[0] == __file__ and function[2] == "profiled":
+                del stats.stats[function]
+        stats.sort_stats("cumulative").print_stats(
+            re.escape(os.path.basename(__file__)), PROFILE_TOP_N
+        )
+
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(f"COMMAND: {name}\n\n")
+            file.write("CUMULATIVE TIME:\n")
+            file.write(cpu_report.getvalue())
+            file.write("\nTOP ALLOCATIONS:\n")
+            for stat in memory_stats[:PROFILE_TOP_N]:
+                file.write(f"{stat}\n")
+
+    def snapshot(self):
+        """
+        Takes a point-in-time, read-only snapshot of the library in O(1).
+
+        The snapshot shares the books, users and indexes with the library. Only
+        the values the library writes afterwards get a new version, the first
+        time each of them is written.
+
+        Returns:
+            LibrarySnapshot: The snapshot of the library.
+        """
+        return LibrarySnapshot(self)
+
+    def _publish(self, action, *args):
+        """
+        Applies a validated mutation to the library and appends it to the change stream.
+
+        Args:
+            action (str): The name of the mutation.
+            *args: The arguments needed to replay the mutation.
+
+        Returns:
+            Change: The published change.
+
+        Raises:
+            ReadOnlyLibraryError: If the library is read-only.
+        """
+        if self.read_only:
+            raise ReadOnlyLibraryError
+        change = Change(self.last_seq() + 1, action, args)
+        self._apply(change)
+        self._record(change)
+        return change
+
+    def _record(self, change):
+        """
+        Appends an applied change to the change stream, if anyone subscribed to it.
+
+        Args:
+            change (Change): The applied change.
+        """
+        if self._subscribers:
+            self.changes.append(change)
+        else:
+            self._truncated_seq = change.seq
+
+    def subscribe(self, seq=0):
+        """
+        Registers a subscriber of the change stream, e.g. a replica. Changes are
+        only kept until all subscribers acknowledged them.
+
+        Args:
+            seq (int, optional): The sequence number of the last change the subscriber already has.
+
+        Returns:
+            int: The ID of the subscriber.
+
+        Raises:
+            ValueError: If changes after seq were already truncated.
+        """
+        if seq < self._truncated_seq:
+            raise ValueError(f"Changes up to {self._truncated_seq} were truncated")
+        subscriber_id = self._next_subscriber_id
+        self._next_subscriber_id += 1
+        self._subscribers[subscriber_id] = seq
+        return subscriber_id
+
+    def acknowledge(self, subscriber_id, seq):
+        """
+        Records that a subscriber applied all changes up to a sequence number,
+        and drops the changes all subscribers applied.
+
+        Args:
+            subscriber_id (int): The ID of the subscriber.
+            seq (int): The sequence number of the last change the subscriber applied.
+        """
+        self._subscribers[subscriber_id] = seq
+        self.truncate_changes(min(self._subscribers.values()))
+
+    def unsubscribe(self, subscriber_id):
+        """
+        Unregisters a subscriber of the change stream.
+
+        Args:
+            subscriber_id (int): The ID of the subscriber.
+        """
+        del self._subscribers[subscriber_id]
+        self.truncate_changes(min(self._subscribers.values(), default=self.last_seq()))
+
+    def changes_since(self, seq):
+        """
+        Retrieves the changes published after a given position in the change stream.
+
+        Args:
+            seq (int): The sequence number of the last change already seen.
+
+        Returns:
+            list: A list of changes with a sequence number greater than seq.
+
+        Raises:
+            ValueError: If some of the requested changes were already truncated.
+        """
+        if seq < self._truncated_seq:
+            raise ValueError(f"Changes up to {self._truncated_seq} were truncated")
+        return self.changes[seq - self._truncated_seq :]
+
+    def last_seq(self):
+        """
+        Retrieves the sequence number of the latest published change.
+
+        Returns:
+            int: The sequence number of the latest change, 0 if none were published.
+        """
+        return self._truncated_seq + len(self.changes)
+
+    def truncate_changes(self, seq):
+        """
+        Drops changes from the change stream up to a sequence number.
+
+        Args:
+            seq (int): The sequence number of the last change to drop.
+        """
+        count = min(seq, self.last_seq()) - self._truncated_seq
+        if count > 0:
+            del self.changes[:count]
+            self._truncated_seq += count
+
+    def _apply(self, change):
+        """
+        Applies a single change to the library state, without any validation.
+
+        Args:
+            change (Change): The change to apply.
+        """
+        match change.action:
+            case "add_user":
+                user_name, is_admin = change.args
+                user = User(user_name, is_admin)
+                user.library = self
+                self._users.set(user_name, user)
+                if is_admin:
+                    self._admin_count += 1
+
+            case "add_book":
+                book_id, title, author = change.args
+                book = Book(title, author, book_id)
+                book.library = self
+                self._books.set(book_id, book)
+                self._available_count += 1
+                author_key = normalize_author(author)
+                self._index_book(self._author_index, author_key, book_id)
+                self._index_book(self._available_author_index, author_key, book_id)
+
+            case "remove_user":
+                (user_name,) = change.args
+                user = self._users.get(user_name)
+                self._loan_count -= len(user.borrowed_books)
+                if user.is_admin:
+                    self._admin_count -= 1
+                self._users.delete(user_name)
+
+            case "remove_book":
+                (book_id,) = change.args
+                book = self._books.get(book_id)
+                self._books.delete(book_id)
+                author_key = normalize_author(book.author)
+                self._unindex_book(self._author_index, author_key, book_id)
+                if book.available:
+                    self._available_count -= 1
+                    self._unindex_book(
+                        self._available_author_index, author_key, book_id
+                    )
+
+            case "borrow":
+                book_id, user_name = change.args
+                book = self._books.writable(book_id, Book.copy)
+                book.available = False
+                self._users.writable(user_name, User.copy).borrowed_books.append(book)
+                self._available_count -= 1
+                self._loan_count += 1
+                self._unindex_book(
+                    self._available_author_index, normalize_author(book.author), book_id
+                )
+
+            case "unborrow":
+                book_id, user_name = change.args
+                book = self._books.get(book_id)
+                self._users.writable(user_name, User.copy).borrowed_books.remove(book)
+                self._books.writable(book_id, Book.copy).available = True
+                self._available_count += 1
+                self._loan_count -= 1
+                self._index_book(
+                    self._available_author_index, normalize_author(book.author), book_id
+                )
+
+            case "change_admin":
+                (user_name,) = change.args
+                user = self._users.writable(user_name, User.copy)
+                user.is_admin = not user.is_admin
+                self._admin_count += 1 if user.is_admin else -1
+
+            case _:
+                raise ValueError(f"Unknown change action: {change.action}")
+
+    def _index_book(self, index, author_key, book_id):
+        """
+        Adds a book ID to the IDs of an author in an author index.
+
+        Args:
+            index (VersionedMap): The author index, mapping authors to dicts of book IDs.
+            author_key (str): The normalized author's name.
+            book_id (int): The ID of the book.
+        """
+        if author_key not in index.current:
+            index.set(author_key, {book_id: None})
+        else:
+            index.writable(author_key, dict)[book_id] = None
+
+    def _unindex_book(self, index, author_key, book_id):
+        """
+        Removes a book ID from the IDs of an author in an author index.
+
+        Args:
+            index (VersionedMap): The author index, mapping authors to dicts of book IDs.
+            author_key (str): The normalized author's name.
+            book_id (int): The ID of the book.
+        """
+        book_ids = index.writable(author_key, dict)
+        del book_ids[book_id]
+        if not book_ids:
+            index.delete(author_key)
 
     def print_books(self, books):
         """
@@ -205,10 +1184,10 @@ class Library:
         Raises:
             BookNotFoundError: If the book is not found.
         """
-        for book in self.books:
-            if book.id == book_id:
-                return book
-        raise BookNotFoundError
+        try:
+            return self._books_by_id[book_id]
+        except KeyError:
+            raise BookNotFoundError
 
     def add_user(self, user_name, is_admin):
         """
@@ -219,7 +1198,7 @@ class Library:
             is_admin (bool): Admin status of the new user.
         """
         if user_name not in self.users:
-            self.users[user_name] = User(user_name, is_admin)
+            self._publish("add_user", user_name, is_admin)
             print("User added.")
         else:
             print("This username is already taken.")
@@ -231,8 +1210,13 @@ class Library:
         Args:
             title (str): The title of the book.
             author (str): The author of the book.
+
+        Raises:
+            ReadOnlyLibraryError: If the library is read-only.
         """
-        self.books.append(Book(title, author))
+        if self.read_only:
+            raise ReadOnlyLibraryError
+        self._publish("add_book", Book.generate_id(), title, author)
 
     def remove_user(self, user_name):
         """
@@ -244,10 +1228,9 @@ class Library:
         Raises:
             UserNotFoundError: If the user is not found.
         """
-        try:
-            del self.users[user_name]
-        except KeyError:
+        if not self.username_exists(user_name):
             raise UserNotFoundError
+        self._publish("remove_user", user_name)
 
     def remove_book(self, book_id):
         """
@@ -259,11 +1242,8 @@ class Library:
         Raises:
             BookNotFoundError: If the book is not found.
         """
-        try:
-            book_to_remove = self.get_book(book_id)
-            self.books.remove(book_to_remove)
-        except BookNotFoundError:
-            raise BookNotFoundError
+        self.get_book(book_id)
+        self._publish("remove_book", book_id)
 
     def borrow(self, book_id, user_name):
         """
@@ -277,8 +1257,7 @@ class Library:
         user = self.get_user(user_name)
 
         if book.available:
-            book.borrow()
-            user.borrow(book)
+            self._publish("borrow", book.id, user.username)
             print("Book borrowed.")
         else:
             print("Book not available.")
@@ -296,8 +1275,7 @@ class Library:
             user = self.get_user(user_name)
 
             if book in user.borrowed_books:
-                book.unborrow()
-                user.unborrow(book)
+                self._publish("unborrow", book.id, user.username)
                 print("Book returned.")
             else:
                 print("You did not borrow this book.")
@@ -313,6 +1291,301 @@ class Library:
         """
         return [book for book in self.books if book.available]
 
+    def stats(self):
+        """
+        Retrieves library-wide statistics, which are kept up to date on every change.
+
+        Returns:
+            dict: The numbers of books, available books, books on loan, users
+                and admins, and the average number of loans per user. Books on
+                loan are the books borrowed by users, including removed books
+                they have not returned, and add up to the loan_count of all users.
+        """
+        return {
+            "books": len(self.books),
+            "available": self._available_count,
+            "on_loan": self._loan_count,
+            "users": len(self.users),
+            "admins": self._admin_count,
+            "average_loans_per_user": (
+                self._loan_count / len(self.users) if self.users else 0.0
+            ),
+        }
+
+    def loan_count(self, user_name):
+        """
+        Retrieves the number of books currently borrowed by a user.
+
+        Args:
+            user_name (str): The username of the user.
+
+        Returns:
+            int: The number of borrowed books.
+
+        Raises:
+            UserNotFoundError: If the user is not found.
+        """
+        return len(self.get_user(user_name).borrowed_books)
+
+    def get_books_by_author(self, author):
+        """
+        Retrieves all books by an author, ignoring case and extra whitespace.
+
+        Args:
+            author (str): The author's name.
+
+        Returns:
+            list: A list of books by the author.
+        """
+        book_ids = self._author_index.get(normalize_author(author), self._generation)
+        return [self._books_by_id[book_id] for book_id in book_ids or ()]
+
+    def get_available_by_author(self, author):
+        """
+        Retrieves all available books by an author, ignoring case and extra whitespace.
+
+        Args:
+            author (str): The author's name.
+
+        Returns:
+            list: A list of available books by the author.
+        """
+        book_ids = self._available_author_index.get(
+            normalize_author(author), self._generation
+        )
+        return [self._books_by_id[book_id] for book_id in book_ids or ()]
+
+    def change_admin(self, user_name):
+        """
+        Toggles the admin status of a user.
+
+        Args:
+            user_name (str): The username of the user.
+
+        Raises:
+            UserNotFoundError: If the user is not found.
+        """
+        self.get_user(user_name)
+        self._publish("change_admin", user_name)
+
+
+class LibraryReplica(Library):
+    """
+    A class to represent a read-only library replica fed from a primary's change stream.
+
+    Read-only queries can be served by a replica, while all mutations go to the
+    primary. A replica subscribes to the primary before the changes it needs are
+    dropped, usually before the primary is populated. A replica in another process
+    can be fed with changes serialized by Change.to_json, and acknowledge its
+    applied_seq to the primary.
+
+    Attributes:
+        applied_seq (int): The sequence number of the last change applied to the replica.
+        subscriber_id (int): The ID of the replica as a subscriber of its primary.
+    """
+
+    read_only = True
+
+    def __init__(self):
+        """
+        Initializes a new, empty LibraryReplica instance.
+        """
+        super().__init__()
+        self.applied_seq = 0
+        self.subscriber_id = None
+
+    def follow(self, primary):
+        """
+        Subscribes the replica to the change stream of a primary in the same process.
+
+        Args:
+            primary (Library): The primary library.
+
+        Raises:
+            ValueError: If changes the replica did not apply were already dropped.
+        """
+        self.subscriber_id = primary.subscribe(self.applied_seq)
+
+    def apply(self, changes):
+        """
+        Applies changes from a primary's change stream, skipping already applied ones.
+
+        Args:
+            changes (list): A list of changes, ordered by sequence number.
+
+        Raises:
+            ValueError: If a change is missing between the applied ones and the given ones.
+        """
+        for change in changes:
+            if change.seq <= self.applied_seq:
+                continue
+            if change.seq != self.applied_seq + 1:
+                raise ValueError(
+                    f"Change {self.applied_seq + 1} is missing, got {change.seq}"
+                )
+            self._apply(change)
+            self._record(change)
+            self.applied_seq = change.seq
+
+    def sync(self, primary):
+        """
+        Applies all changes published by the followed primary since the last sync,
+        and acknowledges them.
+
+        Args:
+            primary (Library): The primary library.
+        """
+        self.apply(primary.changes_since(self.applied_seq))
+        primary.acknowledge(self.subscriber_id, self.applied_seq)
+
+    def lag(self, primary_seq):
+        """
+        Retrieves the number of changes published by the primary but not yet applied.
+
+        Args:
+            primary_seq (int): The sequence number of the primary's latest change.
+
+        Returns:
+            int: The number of pending changes.
+        """
+        return primary_seq - self.applied_seq
+
+
+class LibrarySnapshot(Library):
+    """
+    A class to represent a frozen, read-only view of a library at a point in time.
+
+    Attributes:
+        seq (int): The sequence number of the last change included in the snapshot.
+    """
+
+    read_only = True
+
+    def __init__(self, library):
+        """
+        Initializes a new LibrarySnapshot instance, sharing the state of the library.
+
+        Args:
+            library (Library): The library to take the snapshot of.
+        """
+        super().__init__()
+        self._generation = library._generations.start_snapshot(self)
+        self._users = library._users
+        self._books = library._books
+        self._author_index = library._author_index
+        self._available_author_index = library._available_author_index
+        self.users = self._users.view(self._generation)
+        self._books_by_id = self._books.view(self._generation)
+        self.books = BookList(self._books_by_id)
+        self._available_count = library._available_count
+        self._loan_count = library._loan_count
+        self._admin_count = library._admin_count
+        self.seq = library.last_seq()
+
+    def snapshot(self):
+        """
+        Retrieves a snapshot of the snapshot, which is the snapshot itself.
+
+        Returns:
+            LibrarySnapshot: The snapshot itself.
+        """
+        return self
+
+    def last_seq(self):
+        """
+        Retrieves the sequence number of the last change included in the snapshot.
+
+        Returns:
+            int: The sequence number of the last change included in the snapshot.
+        """
+        return self.seq
+
+
+def iter_export_rows(library, kind):
+    """
+    Generates rows of books, users or current loans from a snapshot of the library.
+
+    The snapshot is iterated lazily, without listing its keys up front, so the
+    extra memory does not grow with the library, which can change between rows.
+
+    Args:
+        library (Library): The library to export.
+        kind (str): One of "books", "users" or "loans".
+
+    Yields:
+        dict: A row with the fields listed in EXPORT_FIELDS for the kind.
+
+    Raises:
+        ValueError: If the kind is not supported.
+    """
+    if kind not in EXPORT_FIELDS:
+        raise ValueError(f"Unsupported export kind: {kind}")
+    snapshot = library.snapshot()
+
+    match kind:
+        case "books":
+            for book in snapshot.books:
+                yield {
+                    "id": book.id,
+                    "title": book.title,
+                    "author": book.author,
+                    "available": book.available,
+                }
+        case "users":
+            for user in snapshot.users.values():
+                yield {
+                    "username": user.username,
+                    "is_admin": user.is_admin,
+                    "books_borrowed": len(user.borrowed_books),
+                }
+        case "loans":
+            for user in snapshot.users.values():
+                for book in user.borrowed_books:
+                    yield {
+                        "book_id": book.id,
+                        "title": book.title,
+                        "username": user.username,
+                    }
+
+
+def export(library, kind, path, fmt="csv", compress=False):
+    """
+    Streams books, users or current loans of the library to a CSV or JSONL file.
+
+    Args:
+        library (Library): The library to export.
+        kind (str): One of "books", "users" or "loans".
+        path (str): The path to the output file.
+        fmt (str, optional): Either "csv" or "jsonl".
+        compress (bool, optional): If True, the file is compressed with gzip.
+
+    Returns:
+        int: The number of exported rows.
+
+    Raises:
+        ValueError: If the kind or format is not supported.
+    """
+    if kind not in EXPORT_FIELDS:
+        raise ValueError(f"Unsupported export kind: {kind}")
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unsupported export format: {fmt}")
+    rows = iter_export_rows(library, kind)
+    opener = gzip.open if compress else open
+    count = 0
+
+    with opener(path, "wt", newline="", encoding="utf-8") as file:
+        if fmt == "csv":
+            writer = csv.DictWriter(file, fieldnames=EXPORT_FIELDS[kind])
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(row) + "\n")
+                count += 1
+    return count
+
 
 def library_init(library):
     """
@@ -361,6 +1634,19 @@ def login(library):
 
 
 def do_action(action, library, user_name):
+    """
+    Performs a specific action based on user input, profiling it if enabled.
+
+    Args:
+        action (str): The action to perform.
+        library (Library): The library instance.
+        user_name (str): The username of the user performing the action.
+    """
+    with library.profiled(action):
+        perform_action(action, library, user_name)
+
+
+def perform_action(action, library, user_name):
     """
     Performs a specific action based on user input.
 
@@ -404,6 +1690,51 @@ def do_action(action, library, user_name):
             library.add_book(new_title, new_author)
             print("Book added.")
 
+        case "vs":
+            # view library statistics
+            if not library.get_user(user_name).is_admin:
+                print("Action not allowed")
+                return
+            print("LIBRARY STATISTICS:")
+            for name, value in library.stats().items():
+                if isinstance(value, float):
+                    value = f"{value:.2f}"
+                print(f"- {name.replace('_', ' ')}: {value}")
+
+        case "ic":
+            # import catalog
+            if not library.get_user(user_name).is_admin:
+                print("Action not allowed")
+                return
+            path = input("Path to the CSV catalog: ")
+            books_before = len(library.books)
+            try:
+                duplicates = ingest_catalog(library, path)
+            except (OSError, ValueError) as e:
+                print(f"Catalog not imported: {e}")
+                return
+            for entry, original in duplicates:
+                print(
+                    f"- Duplicate: '{entry[0]}' by {entry[1]} of '{original[0]}' by {original[1]}"
+                )
+            print(
+                f"Books added: {len(library.books) - books_before}, duplicates skipped: {len(duplicates)}."
+            )
+
+        case "ex":
+            # export data
+            if not library.get_user(user_name).is_admin:
+                print("Action not allowed")
+                return
+            kind = input("What to export? (books/users/loans) ").lower()
+            fmt = input("Format? (csv/jsonl) ").lower()
+            path = input("Path to the output file (.gz to compress): ")
+            try:
+                count = export(library, kind, path, fmt, path.endswith(".gz"))
+                print(f"Rows exported: {count}.")
+            except (OSError, ValueError) as e:
+                print(f"Data not exported: {e}")
+
         case "rmu":
             # remove user
             if not library.get_user(user_name).is_admin:
@@ -433,7 +1764,7 @@ def do_action(action, library, user_name):
             usr_name = input("Username to change admin status: ")
 
             if usr_name != user_name:
-                library.get_user(usr_name).change_admin()
+                library.change_admin(usr_name)
                 print("Admin status changed.")
             else:
                 print("You cannot change your own admin status.")
@@ -448,6 +1779,18 @@ def do_action(action, library, user_name):
             print("AVAILABLE BOOKS:")
             library.print_books(library.get_available())
 
+        case "vba":
+            # view books by author
+            author = input("Author: ")
+            print(f"BOOKS BY {author.upper()}:")
+            library.print_books(library.get_books_by_author(author))
+
+        case "vaba":
+            # view available books by author
+            author = input("Author: ")
+            print(f"AVAILABLE BOOKS BY {author.upper()}:")
+            library.print_books(library.get_available_by_author(author))
+
         case "bb":
             # borrow a book
             book_id = int(input("ID of the book you want to borrow: "))
@@ -473,13 +1816,18 @@ def action_loop(library, user_name):
     admin_menu = """What do you want to do?
         - vb - view all books
         - vu - view all users
+        - vs - view library statistics
         - au - add user
         - ab - add book
+        - ic - import catalog
+        - ex - export books, users or loans
         - rmu - remove user
         - rmb - remove book
         - cua - change user admin status
         - vmb - view my books
         - vab - view available books
+        - vba - view books by author
+        - vaba - view available books by author
         - bb - borrow a book
         - rb - return a book
         - lgo - logout
@@ -488,6 +1836,8 @@ def action_loop(library, user_name):
     user_menu = """What do you want to do?
         - vmb - view my books
         - vab - view available books
+        - vba - view books by author
+        - vaba - view available books by author
         - bb - borrow a book
         - rb - return a book
         - lgo - logout
@@ -506,12 +1856,17 @@ def action_loop(library, user_name):
         do_action(action, library, user_name)
 
 
-def run():
+def run(profile_dir=None):
     """
     Main function to run the library system.
+
+    Args:
+        profile_dir (str, optional): The directory for profiling reports of each command.
     """
     town_lib = Library()
     library_init(town_lib)
+    if profile_dir is not None:
+        print(f"Profiling reports: {town_lib.enable_profiling(profile_dir)}")
 
     while True:
         print()
@@ -543,4 +1898,12 @@ def run():
             action_loop(town_lib, logged_user)
 
 
-run()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Library management system.")
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="write CPU and memory profiling reports of each command to DIR",
+    )
+    args = parser.parse_args()
+    run(args.profile)
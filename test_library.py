@@ -1,5 +1,26 @@
+import csv
+import gzip
+import json
+import os
 import pytest
-from library import Book, User, Library, UserNotFoundError, BookNotFoundError
+import timeit
+import library
+from library import (
+    Book,
+    Change,
+    User,
+    Library,
+    LibraryReplica,
+    UserNotFoundError,
+    BookNotFoundError,
+    ReadOnlyLibraryError,
+    catalog_key,
+    do_action,
+    export,
+    iter_export_rows,
+    find_duplicates,
+    ingest_catalog,
+)
 
 
 # arrange
@@ -20,6 +41,20 @@ def initialise_library(clear_last_id):
     return lib
 
 
+@pytest.fixture
+def replicated_library(clear_last_id):
+    lib = Library()
+    replica = LibraryReplica()
+    replica.follow(lib)
+
+    lib.add_user("Test user", False)
+    lib.add_user("Test user 2", False)
+
+    lib.add_book("Test title", "Test author")
+
+    return lib, replica
+
+
 def test_add_user_when_user_is_unique():
     """
     Test that user with unique username is added to the library
@@ -272,3 +307,746 @@ def test_unborrow_book_when_book_is_nonexistent(capsys, initialise_library):
     assert (
         len(attempted_user.borrowed_books) == 0
     ), "User's borrowed books are not empty"
+
+
+def test_mutations_are_published_to_the_change_stream(replicated_library):
+    """
+    Test that every mutation of the library is recorded in its change stream
+    """
+
+    # arrange
+    lib, _ = replicated_library
+    initial_seq = lib.last_seq()
+
+    # act
+    lib.borrow(1, "Test user")
+    lib.change_admin("Test user 2")
+
+    # assert
+    new_changes = lib.changes_since(initial_seq)
+    assert [change.action for change in new_changes] == [
+        "borrow",
+        "change_admin",
+    ], "Mutations were not published"
+    assert new_changes[-1].seq == lib.last_seq(), "Sequence numbers are incorrect"
+
+
+def test_replica_applies_the_change_stream(replicated_library):
+    """
+    Test that a replica reports its lag and mirrors the primary after a sync
+    """
+
+    # arrange
+    lib, replica = replicated_library
+    lib.borrow(1, "Test user")
+
+    # act
+    initial_lag = replica.lag(lib.last_seq())
+    replica.sync(lib)
+
+    # assert
+    assert initial_lag == lib.last_seq(), "Lag of a new replica is incorrect"
+    assert replica.lag(lib.last_seq()) == 0, "Replica is still lagging after a sync"
+    assert set(replica.users) == set(lib.users), "Users were not replicated"
+    assert replica.get_book(1).available == False, "Borrow was not replicated"
+    assert (
+        len(replica.get_user("Test user").borrowed_books) == 1
+    ), "Borrowed books were not replicated"
+    assert lib.changes == [], "Acknowledged changes were not dropped"
+
+
+def test_replica_applies_serialized_changes(clear_last_id):
+    """
+    Test that a replica can be fed with changes serialized to JSON lines,
+    and that the primary drops the changes once they are acknowledged
+    """
+
+    # arrange
+    lib = Library()
+    subscriber_id = lib.subscribe()
+    replica = LibraryReplica()
+    lib.add_user("Test user", False)
+    lib.add_book("Test title", "Test author")
+    lib.borrow(1, "Test user")
+    lines = [change.to_json() for change in lib.changes_since(0)]
+
+    # act
+    replica.apply([Change.from_json(line) for line in lines])
+    lib.acknowledge(subscriber_id, replica.applied_seq)
+
+    # assert
+    assert replica.applied_seq == lib.last_seq(), "Not all changes were applied"
+    assert replica.get_book(1).available == False, "Borrow was not replicated"
+    assert lib.changes == [], "Acknowledged changes were not dropped"
+    with pytest.raises(ValueError):
+        lib.changes_since(0)
+
+
+def test_changes_are_not_kept_without_subscribers(initialise_library):
+    """
+    Test that the change stream does not grow when nobody subscribed to it
+    """
+
+    # arrange
+    lib = initialise_library
+    last_seq = lib.last_seq()
+
+    # act
+    for _ in range(10):
+        lib.borrow(1, "Test user")
+        lib.unborrow(1, "Test user")
+
+    # assert
+    assert lib.last_seq() == last_seq + 20, "Sequence numbers are incorrect"
+    assert lib.changes == [], "Changes were kept without subscribers"
+
+
+def test_replica_rejects_unknown_change_actions():
+    """
+    Test that a ValueError is raised when a replica receives an unknown change
+    """
+
+    # arrange
+    replica = LibraryReplica()
+
+    # act, assert
+    with pytest.raises(ValueError):
+        replica.apply([Change(1, "bogus_action", ())])
+
+
+def test_replica_rejects_mutations(clear_last_id):
+    """
+    Test that a ReadOnlyLibraryError is raised when trying to mutate a replica,
+    without using up a book ID
+    """
+
+    # arrange
+    replica = LibraryReplica()
+
+    # act, assert
+    with pytest.raises(ReadOnlyLibraryError):
+        replica.add_book("Test title", "Test author")
+    assert Book.last_id == 0, "Book ID was generated for a rejected book"
+
+
+def test_snapshot_is_not_affected_by_later_mutations(initialise_library):
+    """
+    Test that a snapshot keeps the state of the library at the time it was taken
+    """
+
+    # arrange
+    lib = initialise_library
+    snapshot = lib.snapshot()
+
+    # act
+    lib.borrow(1, "Test user")
+    lib.change_admin("Test user 2")
+    lib.add_book("Test title 2", "Test author")
+    lib.remove_user("Test user")
+
+    # assert
+    assert len(snapshot.books) == 1, "Added book is visible in the snapshot"
+    assert "Test user" in snapshot.users, "Removed user is missing in the snapshot"
+    assert snapshot.get_book(1).available == True, "Borrow is visible in the snapshot"
+    assert (
+        snapshot.get_user("Test user 2").is_admin == False
+    ), "Admin status change is visible in the snapshot"
+    assert lib.get_book(1).available == False, "Borrow was not applied to the library"
+    assert len(lib.books) == 2, "Book was not added to the library"
+
+
+def test_unborrow_after_snapshot(initialise_library):
+    """
+    Test that a book borrowed before a snapshot can be returned after it
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.borrow(1, "Test user")
+    snapshot = lib.snapshot()
+
+    # act
+    lib.unborrow(1, "Test user")
+
+    # assert
+    assert lib.get_book(1).available == True, "Book was not returned"
+    assert (
+        len(lib.get_user("Test user").borrowed_books) == 0
+    ), "Book was not removed from borrowed books of the user"
+    assert (
+        len(snapshot.get_user("Test user").borrowed_books) == 1
+    ), "Return is visible in the snapshot"
+
+
+def test_snapshot_rejects_mutations(initialise_library):
+    """
+    Test that a ReadOnlyLibraryError is raised when trying to mutate a snapshot
+    """
+
+    # arrange
+    snapshot = initialise_library.snapshot()
+
+    # act, assert
+    with pytest.raises(ReadOnlyLibraryError):
+        snapshot.borrow(1, "Test user")
+
+
+def test_get_books_by_author(initialise_library):
+    """
+    Test that books by an author are found regardless of case and extra whitespace
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_book("Test title 2", "Test  AUTHOR")
+    lib.add_book("Other title", "Other author")
+
+    # act
+    found_books = lib.get_books_by_author(" test author ")
+
+    # assert
+    assert [book.id for book in found_books] == [1, 2], "Books by author are incorrect"
+    assert lib.get_books_by_author("Nobody") == [], "Unknown author has books"
+
+
+def test_get_available_by_author_when_book_is_borrowed(initialise_library):
+    """
+    Test that borrowed and removed books are not returned as available books by an author
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_book("Test title 2", "Test author")
+    lib.add_book("Test title 3", "Test author")
+
+    # act
+    lib.borrow(1, "Test user")
+    lib.remove_book(3)
+
+    # assert
+    assert [book.id for book in lib.get_available_by_author("Test author")] == [
+        2
+    ], "Available books by author are incorrect"
+
+
+def test_catalog_key_when_entries_differ_in_case_punctuation_and_name_order():
+    """
+    Test that near-duplicate catalog entries have the same key
+    """
+
+    # act
+    key = catalog_key(("The Test Title!", "Anne Bee"))
+    near_duplicate_key = catalog_key(("the test title", "Bee, Anne"))
+    other_key = catalog_key(("The Test Title", "Cee Dee"))
+
+    # assert
+    assert key == near_duplicate_key, "Near-duplicate entries have different keys"
+    assert key != other_key, "Different entries have the same key"
+
+
+def test_find_duplicates_in_parallel(monkeypatch):
+    """
+    Test that duplicates are found when keys are computed in a process pool
+    """
+
+    # arrange
+    monkeypatch.setattr(library, "PARALLEL_INGEST_THRESHOLD", 2)
+    entries = [("Abc", "Anne Bee"), ("Def", "Cee Dee"), ("ABC.", "Bee, Anne")]
+
+    # act
+    unique, duplicates = find_duplicates(entries, workers=2)
+
+    # assert
+    assert unique == entries[:2], "Unique entries are incorrect"
+    assert duplicates == [(entries[2], entries[0])], "Duplicates are incorrect"
+
+
+def test_ingest_catalog(tmp_path, initialise_library):
+    """
+    Test that only unique catalog entries are added to the library
+    """
+
+    # arrange
+    lib = initialise_library
+    path = tmp_path / "catalog.csv"
+    path.write_text(
+        "title,author\n"
+        "New title,Anne Bee\n"
+        'new title,"Bee, Anne"\n'
+        "TEST TITLE,Test author\n"
+    )
+
+    # act
+    duplicates = ingest_catalog(lib, path)
+
+    # assert
+    assert len(lib.books) == 2, "Unique entry was not added to the library"
+    assert duplicates == [
+        (("new title", "Bee, Anne"), ("New title", "Anne Bee")),
+        (("TEST TITLE", "Test author"), ("Test title", "Test author")),
+    ], "Duplicates are incorrect"
+
+
+def test_ingest_catalog_without_merge(tmp_path, initialise_library):
+    """
+    Test that no books are added when duplicates are only reported
+    """
+
+    # arrange
+    lib = initialise_library
+    path = tmp_path / "catalog.csv"
+    path.write_text("title,author\nNew title,Anne Bee\nTest title,Test author\n")
+
+    # act
+    duplicates = ingest_catalog(lib, path, merge=False)
+
+    # assert
+    assert len(lib.books) == 1, "Books were added to the library"
+    assert len(duplicates) == 1, "Duplicate was not reported"
+
+
+def test_export_books_to_csv(tmp_path, initialise_library):
+    """
+    Test that books are exported to a CSV file
+    """
+
+    # arrange
+    lib = initialise_library
+    path = tmp_path / "books.csv"
+
+    # act
+    count = export(lib, "books", path)
+
+    # assert
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert count == 1, "Number of exported rows is incorrect"
+    assert rows == [
+        {"id": "1", "title": "Test title", "author": "Test author", "available": "True"}
+    ], "Exported books are incorrect"
+
+
+def test_export_loans_to_compressed_jsonl(tmp_path, initialise_library):
+    """
+    Test that current loans are exported to a gzip-compressed JSONL file
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.borrow(1, "Test user")
+    path = tmp_path / "loans.jsonl.gz"
+
+    # act
+    export(lib, "loans", path, "jsonl", compress=True)
+
+    # assert
+    with gzip.open(path, "rt") as file:
+        rows = [json.loads(line) for line in file]
+    assert rows == [
+        {"book_id": 1, "title": "Test title", "username": "Test user"}
+    ], "Exported loans are incorrect"
+
+
+def test_export_when_kind_is_unsupported(tmp_path, initialise_library):
+    """
+    Test that a ValueError is raised when trying to export an unsupported kind of data
+    """
+
+    # arrange
+    lib = initialise_library
+
+    # act, assert
+    with pytest.raises(ValueError):
+        export(lib, "authors", tmp_path / "authors.csv")
+
+
+def test_stats_are_updated_on_mutations(initialise_library):
+    """
+    Test that library statistics reflect added, borrowed and removed books and users
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_book("Test title 2", "Test author")
+    lib.add_user("Test admin", True)
+
+    # act
+    lib.borrow(1, "Test user")
+    lib.change_admin("Test user 2")
+    lib.remove_user("Test admin")
+    lib.remove_book(2)
+
+    # assert
+    assert lib.stats() == {
+        "books": 1,
+        "available": 0,
+        "on_loan": 1,
+        "users": 2,
+        "admins": 1,
+        "average_loans_per_user": 0.5,
+    }, "Library statistics are incorrect"
+    assert lib.loan_count("Test user") == 1, "Loan count of the user is incorrect"
+
+
+def test_do_action_view_stats(capsys, monkeypatch, initialise_library):
+    """
+    Test that library statistics are printed with exact counts and a rounded average
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_user("Test admin", True)
+    stats = {"books": 12345678, "average_loans_per_user": 2 / 3}
+    monkeypatch.setattr(lib, "stats", lambda: stats)
+
+    # act
+    do_action("vs", lib, "Test admin")
+
+    # assert
+    output = capsys.readouterr().out
+    assert "- books: 12345678\n" in output, "Book count is not exact"
+    assert "- average loans per user: 0.67\n" in output, "Average is not rounded"
+
+
+def test_do_action_when_profiling_is_enabled(tmp_path, initialise_library):
+    """
+    Test that a profiling report is written for each command when profiling is enabled
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_user("Test admin", True)
+    lib.enable_profiling(tmp_path)
+
+    # act
+    do_action("vb", lib, "Test admin")
+    lib.disable_profiling()
+    do_action("vab", lib, "Test admin")
+
+    # assert
+    (session,) = tmp_path.iterdir()
+    reports = list(session.iterdir())
+    assert [report.name for report in reports] == [
+        "0001-vb.txt"
+    ], "Profiling reports are incorrect"
+    report = reports[0].read_text()
+    assert "print_books" in report, "Library methods are missing in the report"
+    assert "TOP ALLOCATIONS:" in report, "Allocations are missing in the report"
+    assert "(profiled)" not in report, "Profiling code is in the report"
+    assert "tracemalloc.py" not in report, "Profiling allocations are in the report"
+
+
+def test_enable_profiling_twice(tmp_path, initialise_library):
+    """
+    Test that each profiling session writes its reports to its own directory
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_user("Test admin", True)
+
+    # act
+    first = lib.enable_profiling(tmp_path)
+    do_action("vb", lib, "Test admin")
+    second = lib.enable_profiling(tmp_path)
+    do_action("vb", lib, "Test admin")
+
+    # assert
+    assert first != second, "Sessions share a directory"
+    assert os.listdir(first) == ["0001-vb.txt"], "First session report is missing"
+    assert os.listdir(second) == ["0001-vb.txt"], "Second session report is missing"
+
+
+def test_do_action_when_profiling_directory_is_removed(
+    tmp_path, capsys, initialise_library
+):
+    """
+    Test that profiling is disabled with a warning when a report cannot be written
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_user("Test admin", True)
+    os.rmdir(lib.enable_profiling(tmp_path))
+
+    # act
+    do_action("vb", lib, "Test admin")
+
+    # assert
+    output = capsys.readouterr().out
+    assert "Test title" in output, "Command did not run"
+    assert "Profiling report not written" in output, "Warning was not printed"
+    assert lib.profile_dir is None, "Profiling was not disabled"
+
+
+def test_iterate_snapshot_while_library_is_mutated(initialise_library):
+    """
+    Test that a snapshot can be iterated while books are added to and removed from the library
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_book("Test title 2", "Test author")
+    snapshot = lib.snapshot()
+
+    # act
+    titles = []
+    for book in snapshot.books:
+        titles.append(book.title)
+        lib.add_book("New title", "New author")
+        lib.remove_book(book.id)
+
+    # assert
+    assert titles == ["Test title", "Test title 2"], "Snapshot books are incorrect"
+    assert len(snapshot.books) == 2, "Snapshot length is incorrect"
+    assert len(lib.books) == 2, "Library length is incorrect"
+
+
+def test_get_available_by_author_in_snapshot(initialise_library):
+    """
+    Test that author queries of a snapshot are not affected by later borrows
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_book("Test title 2", "Test author")
+    snapshot = lib.snapshot()
+
+    # act
+    lib.borrow(1, "Test user")
+
+    # assert
+    assert [book.id for book in snapshot.get_available_by_author("Test author")] == [
+        1,
+        2,
+    ], "Borrow is visible in the snapshot"
+    assert [book.id for book in lib.get_available_by_author("Test author")] == [
+        2
+    ], "Borrow was not applied to the library"
+
+
+def test_ingest_catalog_when_columns_are_missing(tmp_path, initialise_library):
+    """
+    Test that a ValueError is raised when the catalog has no title and author columns
+    """
+
+    # arrange
+    lib = initialise_library
+    path = tmp_path / "catalog.csv"
+    path.write_text("name,writer\nNew title,Anne Bee\n")
+
+    # act, assert
+    with pytest.raises(ValueError):
+        ingest_catalog(lib, path)
+    assert len(lib.books) == 1, "Books were added to the library"
+
+
+def test_import_catalog_action_when_file_is_missing(
+    capsys, monkeypatch, tmp_path, initialise_library
+):
+    """
+    Test that a message is printed instead of an error when the catalog file is missing
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_user("Test admin", True)
+    monkeypatch.setattr("builtins.input", lambda prompt: str(tmp_path / "missing.csv"))
+
+    # act
+    do_action("ic", lib, "Test admin")
+    message = capsys.readouterr().out.split("\n")[-2]
+
+    # assert
+    assert message.startswith("Catalog not imported:"), "Message was not printed"
+
+
+def test_export_action_when_directory_is_missing(
+    capsys, monkeypatch, tmp_path, initialise_library
+):
+    """
+    Test that a message is printed instead of an error when the output directory is missing
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_user("Test admin", True)
+    answers = iter(["books", "csv", str(tmp_path / "missing" / "books.csv")])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+
+    # act
+    do_action("ex", lib, "Test admin")
+    message = capsys.readouterr().out.split("\n")[-2]
+
+    # assert
+    assert message.startswith("Data not exported:"), "Message was not printed"
+
+
+def test_user_mutators_when_user_is_owned_by_a_snapshot(initialise_library):
+    """
+    Test that a ReadOnlyLibraryError is raised when trying to change a user read
+    from a snapshot, and that the live library is left unchanged
+    """
+
+    # arrange
+    lib = initialise_library
+    snapshot = lib.snapshot()
+    last_seq = lib.last_seq()
+    user = snapshot.get_user("Test user")
+    book = snapshot.get_book(1)
+
+    # act + assert
+    with pytest.raises(ReadOnlyLibraryError):
+        user.change_admin()
+    with pytest.raises(ReadOnlyLibraryError):
+        user.borrow(book)
+    with pytest.raises(ReadOnlyLibraryError):
+        user.unborrow(book)
+    assert lib.get_user("Test user").is_admin == False, "Admin status was changed"
+    assert lib.get_book(1).available == True, "Book was borrowed"
+    assert lib.stats()["admins"] == 0, "Admin count was changed"
+    assert lib.last_seq() == last_seq, "Change was published"
+
+
+def test_stats_when_borrowed_book_is_removed(initialise_library):
+    """
+    Test that books on loan still match the users' loan counts after a borrowed
+    book is removed
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.borrow(1, "Test user")
+
+    # act
+    lib.remove_book(1)
+
+    # assert
+    assert lib.stats()["on_loan"] == 1, "Removed book is no longer on loan"
+    assert lib.loan_count("Test user") == 1, "Loan count of the user is incorrect"
+
+
+def test_book_borrow_when_book_is_owned_by_a_library(initialise_library):
+    """
+    Test that a ReadOnlyLibraryError is raised when trying to borrow a library book
+    outside of the library
+    """
+
+    # arrange
+    lib = initialise_library
+
+    # act, assert
+    with pytest.raises(ReadOnlyLibraryError):
+        lib.get_book(1).borrow()
+    assert lib.stats()["available"] == 1, "Available count was changed"
+
+
+def test_get_available_is_as_fast_as_a_dict_scan(clear_last_id):
+    """
+    Test that listing available books of a library with a live snapshot
+    takes about as long as scanning a plain dictionary of the books
+    """
+
+    # arrange
+    lib = Library()
+    for i in range(20000):
+        lib.add_book(f"Title {i}", f"Author {i % 100}")
+    snapshot = lib.snapshot()
+    plain_books = {book.id: book for book in lib.books}
+
+    # act
+    library_time = min(timeit.repeat(lib.get_available, number=5, repeat=3))
+    dict_time = min(
+        timeit.repeat(
+            lambda: [book for book in plain_books.values() if book.available],
+            number=5,
+            repeat=3,
+        )
+    )
+
+    # assert
+    assert len(snapshot.books) == 20000, "Snapshot length is incorrect"
+    assert (
+        library_time < 3 * dict_time
+    ), f"get_available took {library_time:.4f}s against {dict_time:.4f}s for a dict scan"
+
+
+def test_snapshot_when_user_is_removed_and_added_again(initialise_library):
+    """
+    Test that a snapshot lists the old version of a user removed and added again afterwards
+    """
+
+    # arrange
+    lib = initialise_library
+    snapshot = lib.snapshot()
+
+    # act
+    lib.remove_user("Test user")
+    lib.add_user("Test user", True)
+
+    # assert
+    assert list(snapshot.users) == [
+        "Test user",
+        "Test user 2",
+    ], "Snapshot users are incorrect"
+    assert (
+        snapshot.get_user("Test user").is_admin == False
+    ), "New user is in the snapshot"
+    assert list(lib.users) == [
+        "Test user 2",
+        "Test user",
+    ], "Library users are incorrect"
+
+
+def test_ingest_catalog_when_row_is_short(tmp_path, initialise_library):
+    """
+    Test that a ValueError with the line number is raised when a row has no author
+    """
+
+    # arrange
+    lib = initialise_library
+    path = tmp_path / "catalog.csv"
+    path.write_text("title,author\nNew title,Anne Bee\nOnly a title\n")
+
+    # act, assert
+    with pytest.raises(ValueError, match="Line 3"):
+        ingest_catalog(lib, path)
+    assert len(lib.books) == 1, "Books were added to the library"
+
+
+def test_ingest_catalog_when_csv_is_malformed(tmp_path, initialise_library):
+    """
+    Test that a ValueError is raised when the catalog is not a valid CSV file
+    """
+
+    # arrange
+    lib = initialise_library
+    path = tmp_path / "catalog.csv"
+    path.write_text("title,author\n" + "x" * 200000 + ",Anne Bee\n")
+
+    # act, assert
+    with pytest.raises(ValueError):
+        ingest_catalog(lib, path)
+
+
+def test_iter_export_rows_while_library_is_mutated(initialise_library):
+    """
+    Test that exported rows keep the state of the library at the start of the export
+    """
+
+    # arrange
+    lib = initialise_library
+    lib.add_book("Test title 2", "Test author")
+    rows = iter_export_rows(lib, "books")
+
+    # act
+    first_row = next(rows)
+    lib.borrow(2, "Test user")
+    lib.add_book("Test title 3", "Test author")
+    other_rows = list(rows)
+
+    # assert
+    assert first_row["id"] == 1, "First exported book is incorrect"
+    assert other_rows == [
+        {"id": 2, "title": "Test title 2", "author": "Test author", "available": True}
+    ], "Changes made during the export are exported"